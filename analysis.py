@@ -2,6 +2,16 @@ import numpy as np
 import os
 import csv
 import datetime
+import re
+from functools import lru_cache
+
+# Parsed compensation files keyed by (abspath, mtime, size), holding
+# (freqs, dbs, Compensation) so unchanged files are only parsed once.
+_COMP_CACHE = {}
+
+def _compensation_cache_key(filename):
+    st = os.stat(filename)
+    return os.path.abspath(filename), st.st_mtime_ns, st.st_size
 
 def load_compensation_file(filename):
     """Loads a compensation file with frequency and dB pairs."""
@@ -9,20 +19,68 @@ def load_compensation_file(filename):
         print(f"Warning: Compensation file '{filename}' not found. No compensation will be applied.")
         return None, None
     try:
-        data = np.loadtxt(filename, delimiter=',', skiprows=1)
+        key = _compensation_cache_key(filename)
+        if key in _COMP_CACHE:
+            freqs, dbs, _ = _COMP_CACHE[key]
+            return freqs, dbs
+        data = np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
         freqs, dbs = data[:, 0], data[:, 1]
+        _COMP_CACHE[key] = (freqs, dbs, Compensation(freqs, dbs))
         print(f"Successfully loaded compensation file: {filename}")
         return freqs, dbs
     except Exception as e:
         print(f"Error loading compensation file '{filename}': {e}")
         return None, None
 
+def load_compensation(filename):
+    """
+    Loads a compensation file as a Compensation object. If the file is
+    missing or invalid, the returned object applies no compensation.
+    """
+    freqs, dbs = load_compensation_file(filename)
+    if freqs is None:
+        return NO_COMPENSATION
+    try:
+        return _COMP_CACHE[_compensation_cache_key(filename)][2]
+    except (OSError, KeyError):
+        # File changed between the two lookups
+        return Compensation(freqs, dbs)
+
 def get_compensation(freq_hz, comp_freqs, comp_dbs):
     """Calculates compensation for a given frequency using linear interpolation."""
     if comp_freqs is None or comp_dbs is None or len(comp_freqs) == 0:
         return 0.0
     return np.interp(freq_hz, comp_freqs, comp_dbs)
 
+def prepare_compensation(comp_freqs, comp_dbs):
+    """
+    Sorts a compensation table by frequency, as np.interp requires.
+    Returns None if there is no compensation data.
+    """
+    if comp_freqs is None or comp_dbs is None or len(comp_freqs) == 0:
+        return None
+    order = np.argsort(comp_freqs, kind='stable')
+    freqs = np.asarray(comp_freqs, dtype=np.float64)[order]
+    dbs = np.asarray(comp_dbs, dtype=np.float64)[order]
+    return freqs, dbs
+
+class Compensation:
+    """
+    A frequency to dB compensation table. Built without data it applies
+    no compensation and skips interpolation entirely.
+    """
+    def __init__(self, comp_freqs=None, comp_dbs=None):
+        self.prepared = prepare_compensation(comp_freqs, comp_dbs)
+
+    def apply(self, freqs_hz):
+        """Returns the compensation in dB for an array of frequencies."""
+        if self.prepared is None:
+            return np.zeros(np.shape(freqs_hz))
+        freqs, dbs = self.prepared
+        return np.interp(freqs_hz, freqs, dbs)
+
+NO_COMPENSATION = Compensation()
+
 def dbm_to_watts_formatted(dbm):
     """Converts dBm to a formatted string in W, mW, or µW."""
     watts = 10**((dbm - 30) / 10)
@@ -33,6 +91,23 @@ def dbm_to_watts_formatted(dbm):
     else:
         return f"{watts * 1e6:.2f} µW"
 
+# Power unit thresholds (W) and the scale/unit used below, at and above each
+_WATT_THRESHOLDS = np.array([1e-3, 1.0])
+_WATT_SCALES = np.array([1e6, 1e3, 1.0])
+_WATT_UNITS = ("µW", "mW", "W")
+
+def dbm_array_to_watts(dbm_arr):
+    """Converts an array of dBm values to watts."""
+    return np.power(10.0, (np.asarray(dbm_arr, dtype=np.float64) - 30.0) / 10.0)
+
+def dbm_array_to_watts_formatted(dbm_arr):
+    """Vectorized dbm_to_watts_formatted, returning a list of strings."""
+    watts = dbm_array_to_watts(dbm_arr)
+    unit_idx = np.searchsorted(_WATT_THRESHOLDS, watts, side='right')
+    scaled = watts * _WATT_SCALES[unit_idx]
+    return [f"{value:.2f} {_WATT_UNITS[i]}" for value, i in zip(scaled.tolist(), unit_idx.tolist())]
+
+@lru_cache(maxsize=512)
 def format_frequency(freq_hz):
     """
     Formats a frequency in Hz to a string with appropriate units (kHz, MHz, GHz)
@@ -57,46 +132,58 @@ def format_frequency(freq_hz):
     
     return f"{value:.{precision}f} {unit}"
 
+_FREQ_MULTIPLIERS = {
+    '': 1.0, 'hz': 1.0,
+    'k': 1e3, 'khz': 1e3,
+    'm': 1e6, 'mhz': 1e6,
+    'g': 1e9, 'ghz': 1e9,
+}
+_FREQ_RE = re.compile(r'^([\d.+\-e]+)([a-z]*)$')
+
 def parse_frequency(freq_str):
     """Parses a frequency string (e.g., '100mhz', '2.4g') into Hz."""
-    freq_str = freq_str.lower().replace(" ", "")
-    
-    if freq_str.endswith("khz"):
-        return float(freq_str[:-3]) * 1e3
-    elif freq_str.endswith("k"):
-        return float(freq_str[:-1]) * 1e3
-    elif freq_str.endswith("mhz"):
-        return float(freq_str[:-3]) * 1e6
-    elif freq_str.endswith("m"):
-        return float(freq_str[:-1]) * 1e6
-    elif freq_str.endswith("ghz"):
-        return float(freq_str[:-3]) * 1e9
-    elif freq_str.endswith("g"):
-        return float(freq_str[:-1]) * 1e9
-    else:
-        return float(freq_str)
+    match = _FREQ_RE.match(freq_str.lower().replace(" ", ""))
+    if not match or match[2] not in _FREQ_MULTIPLIERS:
+        raise ValueError(f"Could not parse frequency: '{freq_str}'")
+    return float(match[1]) * _FREQ_MULTIPLIERS[match[2]]
+
+# Carrier frequency band edges and the search range used within each band
+_SEARCH_RANGE_EDGES = np.array([1e6, 10e6, 500e6, 3e9])
+_SEARCH_RANGES = np.array([10e6, 100e6, 2.5e9, 10e9, 26e9])
+
+def get_search_ranges(carrier_freqs_hz):
+    """Vectorized get_search_range for an array of carrier frequencies."""
+    return _SEARCH_RANGES[np.digitize(carrier_freqs_hz, _SEARCH_RANGE_EDGES)]
 
 def get_search_range(carrier_freq_hz):
     """Determines the spurious emission search range based on carrier frequency."""
-    if carrier_freq_hz < 1e6:
-        return 10e6
-    elif carrier_freq_hz < 10e6:
-        return 100e6
-    elif carrier_freq_hz < 500e6:
-        return 2.5e9
-    elif carrier_freq_hz < 3e9:
-        return 10e9
-    else:
-        return 26e9
+    return float(get_search_ranges(carrier_freq_hz))
+
+# Highest measurement index seen per report file, keyed by filename and
+# stored alongside the file's (mtime, size) so external edits invalidate it.
+_MAX_INDEX_CACHE = {}
+
+def _file_stamp(file):
+    """Returns an (mtime, size) stamp used to detect changes to a file path or descriptor."""
+    st = os.stat(file)
+    return st.st_mtime_ns, st.st_size
 
 def get_next_measurement_index(filename='peak_report.csv'):
     """
     Calculates the next measurement index by reading a CSV file.
     If the file doesn't exist, it returns 0. Otherwise, it returns
-    the highest index found + 1.
+    the highest index found + 1. The result is cached until the file
+    changes on disk, so repeated calls don't rescan the whole report.
     """
-    if not os.path.exists(filename):
+    try:
+        stamp = _file_stamp(filename)
+    except FileNotFoundError:
         return 0
+    except OSError:
+        stamp = None
+    cached = _MAX_INDEX_CACHE.get(filename)
+    if stamp is not None and cached is not None and cached[0] == stamp:
+        return cached[1] + 1
     
     max_index = -1
     try:
@@ -124,65 +211,103 @@ def get_next_measurement_index(filename='peak_report.csv'):
         print(f"Warning: Could not read {filename}. Assuming index 0.")
         return 0
 
+    if stamp is not None:
+        _MAX_INDEX_CACHE[filename] = (stamp, max_index)
     return max_index + 1
 
+PEAK_REPORT_FIELDNAMES = [
+    'measurement_index', 'timestamp', 'peak_type', 
+    'frequency_hz', 'measured_power_dbm', 'compensation_db', 'corrected_power_dbm',
+    'note'
+]
+
+def _build_peak_rows(carrier_peaks, spurious_peaks, compensation, note, measurement_index, timestamp):
+    """Builds peak report rows, in PEAK_REPORT_FIELDNAMES order."""
+    peaks = np.vstack([
+        np.asarray(carrier_peaks, dtype=np.float64).reshape(-1, 2),
+        np.asarray(spurious_peaks, dtype=np.float64).reshape(-1, 2),
+    ])
+    peak_types = ['carrier'] * len(carrier_peaks) + ['spurious'] * len(spurious_peaks)
+
+    # Look up compensation for every peak with a single np.interp call
+    freqs = peaks[:, 0]
+    powers = peaks[:, 1]
+    comps = compensation.apply(freqs)
+    corrected = powers - comps
+
+    return [
+        (measurement_index, timestamp, peak_type, freq, power, comp_db, corrected_power, note)
+        for peak_type, freq, power, comp_db, corrected_power in zip(
+            peak_types, freqs.tolist(), powers.tolist(), comps.tolist(), corrected.tolist())
+    ]
+
+class CsvAppender:
+    """
+    Keeps a peak report CSV open for appending across several measurements,
+    writing the header if the file is new.
+    """
+    def __init__(self, filename='peak_report.csv'):
+        self.filename = filename
+        self.file = None
+        self.writer = None
+
+    def __enter__(self):
+        self.file = open(self.filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        # An empty file needs a header; no separate existence check required
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() == 0:
+            self.writer.writerow(PEAK_REPORT_FIELDNAMES)
+            self.file.flush()
+            _MAX_INDEX_CACHE[self.filename] = (_file_stamp(self.file.fileno()), -1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def append(self, carrier_peaks, spurious_peaks, compensation, note, measurement_index=None, timestamp=None):
+        """Appends a list of carrier and spurious peaks to the open CSV file."""
+        if measurement_index is None:
+            measurement_index = get_next_measurement_index(self.filename)
+        if timestamp is None:
+            timestamp = datetime.datetime.now().isoformat()
+
+        rows_to_write = _build_peak_rows(carrier_peaks, spurious_peaks, compensation, note, measurement_index, timestamp)
+        if not rows_to_write:
+            return
+
+        # Only carry the cached index forward if it was still valid before this write
+        cached = _MAX_INDEX_CACHE.get(self.filename)
+        cache_valid = cached is not None and cached[0] == _file_stamp(self.file.fileno())
+        self.writer.writerows(rows_to_write)
+        self.file.flush()
+        if cache_valid:
+            _MAX_INDEX_CACHE[self.filename] = (_file_stamp(self.file.fileno()), max(cached[1], measurement_index))
+        else:
+            _MAX_INDEX_CACHE.pop(self.filename, None)
+        print(f"\nAppended {len(rows_to_write)} peaks to {self.filename} with measurement index {measurement_index}.")
+
 def append_peaks_to_csv(carrier_peaks, spurious_peaks, comp_freqs, comp_dbs, note, filename='peak_report.csv', measurement_index=None, timestamp=None):
     """Appends a list of carrier and spurious peaks to a CSV file."""
-    if measurement_index is None:
-        measurement_index = get_next_measurement_index(filename)
-    if timestamp is None:
-        timestamp = datetime.datetime.now().isoformat()
-    
-    fieldnames = [
-        'measurement_index', 'timestamp', 'peak_type', 
-        'frequency_hz', 'measured_power_dbm', 'compensation_db', 'corrected_power_dbm',
-        'note'
-    ]
-    
-    rows_to_write = []
-    
-    for freq, power in carrier_peaks:
-        comp_db = get_compensation(freq, comp_freqs, comp_dbs)
-        corrected_power = power - comp_db
-        rows_to_write.append({
-            'measurement_index': measurement_index, 'timestamp': timestamp, 'peak_type': 'carrier',
-            'frequency_hz': freq, 'measured_power_dbm': power,
-            'compensation_db': comp_db, 'corrected_power_dbm': corrected_power,
-            'note': note
-        })
-
-    for freq, power in spurious_peaks:
-        comp_db = get_compensation(freq, comp_freqs, comp_dbs)
-        corrected_power = power - comp_db
-        rows_to_write.append({
-            'measurement_index': measurement_index, 'timestamp': timestamp, 'peak_type': 'spurious',
-            'frequency_hz': freq, 'measured_power_dbm': power,
-            'compensation_db': comp_db, 'corrected_power_dbm': corrected_power,
-            'note': note
-        })
-
-    if not rows_to_write:
+    if len(carrier_peaks) == 0 and len(spurious_peaks) == 0:
         return
-
-    file_exists = os.path.exists(filename)
     try:
-        with open(filename, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerows(rows_to_write)
-        print(f"\nAppended {len(rows_to_write)} peaks to {filename} with measurement index {measurement_index}.")
+        with CsvAppender(filename) as appender:
+            appender.append(carrier_peaks, spurious_peaks, Compensation(comp_freqs, comp_dbs), note, measurement_index, timestamp)
     except IOError as e:
         print(f"\nError writing to {filename}: {e}")
 
 def separate_carrier_and_spurious(peaks, carrier_freq):
-    """Separates a list of peaks into carrier and spurious signals."""
-    carrier_peaks, spurious_peaks = [], []
+    """
+    Separates peaks into carrier and spurious signals, returned as
+    (N, 2) arrays of (frequency, power) rows.
+    """
+    peak_array = np.asarray(peaks, dtype=np.float64).reshape(-1, 2)
     tolerance = max(carrier_freq * 0.01, 100e3)
-    for freq, power in peaks:
-        if abs(freq - carrier_freq) < tolerance:
-            carrier_peaks.append((freq, power))
-        else:
-            spurious_peaks.append((freq, power))
-    return carrier_peaks, spurious_peaks
-
+    is_carrier = np.abs(peak_array[:, 0] - carrier_freq) < tolerance
+    return peak_array[is_carrier], peak_array[~is_carrier]
@@ -1,10 +1,12 @@
+import logging
 import numpy as np
 import pyvisa as visa
 import time
 import analysis
 from hp8593em import HP8593EM
-import pandas as pd
+from visa_utils import discover_and_connect, load_address_hints
 import os
+import csv
 
 COMPENSATION_FILE = 'ext_att_compensation.csv'
 
@@ -30,22 +32,26 @@ def update_compensation_file(new_points, filename):
     Adds new points to the compensation file, removing any existing points
     within a 10% frequency tolerance.
     """
+    existing = np.empty((0, 2))
     if os.path.exists(filename):
-        df = pd.read_csv(filename, header=0, names=['frequency', 'attenuation'], comment='#')
-    else:
-        df = pd.DataFrame(columns=['frequency', 'attenuation'])
-
-    for freq, att in new_points:
-        # Remove existing points within 10% of the new frequency
-        df = df[~((df['frequency'] >= freq * 0.9) & (df['frequency'] <= freq * 1.1))]
-    
-    new_df = pd.DataFrame(new_points, columns=['frequency', 'attenuation'])
-    df = pd.concat([df, new_df], ignore_index=True)
-    df = df.sort_values(by='frequency').reset_index(drop=True)
-
-    with open(filename, 'w') as f:
+        # Skip the header line, whatever its format, as load_compensation_file does
+        with open(filename) as f:
+            data_lines = f.read().splitlines()[1:]
+        if any(line.strip() for line in data_lines):
+            existing = np.loadtxt(data_lines, delimiter=',', ndmin=2).reshape(-1, 2)
+    new_array = np.asarray(new_points, dtype=np.float64).reshape(-1, 2)
+
+    # Remove existing points within 10% of any new frequency in one pass
+    new_freqs = new_array[:, 0]
+    old_freqs = existing[:, 0][:, None]
+    mask = ((old_freqs >= new_freqs * 0.9) & (old_freqs <= new_freqs * 1.1)).any(axis=1)
+
+    merged = np.vstack([existing[~mask], new_array])
+    merged = merged[np.argsort(merged[:, 0], kind='stable')]
+
+    with open(filename, 'w', newline='') as f:
         f.write("# Frequency (Hz), Attenuation (dB)\n")
-        df.to_csv(f, index=False, header=False)
+        csv.writer(f, lineterminator='\n').writerows(merged.tolist())
     print(f"\nUpdated {filename} with {len(new_points)} new points.")
 
 def generate_frequency_ranges(start_freq, end_freq):
@@ -68,7 +74,10 @@ def main():
     sa = None
 
     try:
-        sa = HP8593EM(GPIB_ADDRESS)
+        # Try the usual address first unless the hints say otherwise
+        address_hints = {'8593EM': GPIB_ADDRESS, **load_address_hints()}
+        found_devices = discover_and_connect({'8593EM': HP8593EM}, address_hints)
+        sa = found_devices['8593EM']
         print(f"Connected to: {sa.get_id()}")
         
         start_freq, end_freq = get_frequency_range()
@@ -78,6 +87,7 @@ def main():
         
         min_atten_overall = (float('inf'), 0)
         max_atten_overall = (float('-inf'), 0)
+        freq_buf = att_buf = sweep_steps = None
 
         for i, (sub_start_freq, sub_end_freq) in enumerate(frequency_ranges):
             print(f"\n--- Measuring sub-range {i+1}/{len(frequency_ranges)}: {analysis.format_frequency(sub_start_freq)} to {analysis.format_frequency(sub_end_freq)} ---")
@@ -105,22 +115,31 @@ def main():
             # Get trace data
             try:
                 raw_data = sa.get_trace_data(1)
-                raw_points = [float(p) for p in raw_data.strip().split('\r')]
+                # Let NumPy do the string-to-float conversion; still raises ValueError on bad data
+                raw_points = np.array(raw_data.strip().split('\r'), dtype=np.float64)
                 
-                attenuations = [(p / 100) - 80 for p in raw_points]
+                # Reuse the same buffers for every sub-range with the same sweep length
+                num_points = raw_points.size
+                if freq_buf is None or freq_buf.size != num_points:
+                    sweep_steps = np.linspace(0.0, 1.0, num_points)
+                    freq_buf = np.empty(num_points)
+                    att_buf = np.empty(num_points)
+
+                attenuations = np.divide(raw_points, 100, out=att_buf)
+                attenuations -= 80
+
+                frequencies = np.multiply(sweep_steps, actual_end_freq - actual_start_freq, out=freq_buf)
+                frequencies += actual_start_freq
+                frequencies[-1] = actual_end_freq
                 
-                num_points = len(attenuations)
-                frequencies = np.linspace(actual_start_freq, actual_end_freq, num_points)
-                
-                new_compensation_points = list(zip(frequencies, attenuations))
-                all_compensation_points.extend(new_compensation_points)
+                all_compensation_points.extend(zip(frequencies.tolist(), attenuations.tolist()))
 
-                min_atten_segment = min(attenuations)
-                max_atten_segment = max(attenuations)
-                if min_atten_segment < min_atten_overall[0]:
-                    min_atten_overall = (min_atten_segment, frequencies[attenuations.index(min_atten_segment)])
-                if max_atten_segment > max_atten_overall[0]:
-                    max_atten_overall = (max_atten_segment, frequencies[attenuations.index(max_atten_segment)])
+                i_min = attenuations.argmin()
+                i_max = attenuations.argmax()
+                if attenuations[i_min] < min_atten_overall[0]:
+                    min_atten_overall = (attenuations[i_min], frequencies[i_min])
+                if attenuations[i_max] > max_atten_overall[0]:
+                    max_atten_overall = (attenuations[i_max], frequencies[i_max])
 
             except (ValueError, IndexError) as e:
                 print(f"  Could not parse attenuation data: {e}")
@@ -134,7 +153,7 @@ def main():
             print(f"Minimum Attenuation: {min_atten_overall[0]:.2f} dB at {analysis.format_frequency(min_atten_overall[1])}")
             print(f"Maximum Attenuation: {max_atten_overall[0]:.2f} dB at {analysis.format_frequency(max_atten_overall[1])}")
 
-    except visa.errors.VisaIOError as e:
+    except (visa.errors.VisaIOError, ConnectionError) as e:
         print(f"\nError communicating with instrument: {e}")
     except Exception as e:
         print(f"\nAn error occurred: {e}")
@@ -146,4 +165,5 @@ def main():
         print("\nConnection closed.")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
@@ -1,15 +1,34 @@
+import numpy as np
 import pyvisa as visa
 import time
+import logging
+import re
+from visa_utils import configure_resource, get_rm
+
+log = logging.getLogger(__name__)
+
+# Number of signals requested per compound SIGPOS/SIGRESULT? command
+SIGNAL_BATCH_SIZE = 10
+
+# How long reset() waits on *OPC? before assuming it isn't supported
+RESET_OPC_TIMEOUT_S = 3
+
+# How long a measurement waits for an SRQ before falling back to polling
+SRQ_WAIT_S = 5
+
+def _split_responses(response):
+    """Splits a reply to a compound query into its individual responses."""
+    return [part for part in re.split(r'[\r\n;]+', response) if part.strip()]
 
 class HP8593EM:
     def __init__(self, resource_or_address):
         if isinstance(resource_or_address, str):
-            rm = visa.ResourceManager()
-            self.instrument = rm.open_resource(resource_or_address)
+            self.instrument = get_rm().open_resource(resource_or_address)
         else:
             self.instrument = resource_or_address
         
         self.instrument.timeout = 10000
+        configure_resource(self.instrument)
 
     def __enter__(self):
         return self
@@ -18,17 +37,19 @@ class HP8593EM:
         self.close()
 
     def write(self, command):
-        print(f"GPIB WRITE: {command}")
+        log.debug("GPIB WRITE: %s", command)
         self.instrument.write(command)
 
     def read(self):
         response = self.instrument.read()
-        print(f"GPIB READ: {response.strip()}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("GPIB READ: %s", response.strip())
         return response
 
     def query(self, command):
         response = self.instrument.query(command)
-        print(f"GPIB QUERY '{command}': {response.strip()}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("GPIB QUERY '%s': %s", command, response.strip())
         return response
 
     def close(self):
@@ -39,10 +60,11 @@ class HP8593EM:
 
     def reset(self):
         """Resets the instrument and configures it for EMC peak measurements."""
-        self.write("*RST")
-        time.sleep(1)
-        self.write("MODE EMC")
-        time.sleep(1)
+        # Wait for each step to actually finish, falling back to a fixed delay
+        if not self.wait_for_operation_complete(RESET_OPC_TIMEOUT_S, command="*RST"):
+            time.sleep(1)
+        if not self.wait_for_operation_complete(RESET_OPC_TIMEOUT_S, command="MODE EMC"):
+            time.sleep(1)
         self.write("AT AUTO")
         self.write("ARNG ON")
         self.write("AUNITS DBM")
@@ -51,12 +73,30 @@ class HP8593EM:
         self.write("AUTOQPD OFF")
         self.write("AUTOAVG OFF")
 
+    def set_center_frequency_cmd(self, freq_hz):
+        return f"CF {freq_hz}Hz"
+
     def set_center_frequency(self, freq_hz):
-        self.write(f"CF {freq_hz}Hz")
+        self.write(self.set_center_frequency_cmd(freq_hz))
 
     def set_span(self, span_hz):
         self.write(f"SP {span_hz}Hz")
 
+    def set_zero_span(self):
+        self.set_span(0)
+
+    def get_marker_power(self):
+        """Moves the marker to the highest peak and returns its amplitude."""
+        return float(self.query("MKPK HI;MKA?"))
+
+    def measure_marker_power(self, freq_hz):
+        """
+        Tunes to freq_hz, takes a sweep and returns the peak marker amplitude
+        in a single transaction. TS holds off the marker commands until the
+        sweep has finished, so no host-side settling delay is needed.
+        """
+        return float(self.query(f"{self.set_center_frequency_cmd(freq_hz)};TS;MKPK HI;MKA?"))
+
     def set_start_frequency(self, freq_hz):
         self.write(f"FA {freq_hz}Hz")
 
@@ -94,22 +134,87 @@ class HP8593EM:
     def take_sweep_and_wait(self):
         """Queries sweep time, initiates a sweep, and waits for it to complete."""
         sweep_time_s = self.get_sweep_time()
-        self.write("TS")
-        # Wait for sweep to complete, with a small buffer
-        time.sleep(sweep_time_s * 1.1 + 0.1)
+        start_time = time.time()
+        # Sweep and block on *OPC? in one transaction so we return as soon as it's done
+        if self.wait_for_operation_complete(sweep_time_s * 1.5 + 1, command="TS"):
+            return
+        # Otherwise wait for sweep to complete, with a small buffer
+        time.sleep(max(0, sweep_time_s * 1.1 + 0.1 - (time.time() - start_time)))
 
     def get_sweep_time(self):
         """Queries the instrument for its sweep time."""
         return float(self.query("SWPT?"))
 
     def get_trace_data(self, trace_num):
-        return self.query(f"TA?")
+        # Trace points can be line-separated, so read the whole block up to EOI
+        previous_termination = self.instrument.read_termination
+        self.instrument.read_termination = None
+        try:
+            return self.query(f"TA?")
+        finally:
+            self.instrument.read_termination = previous_termination
+
+    def wait_for_operation_complete(self, timeout_s, command=None):
+        """
+        Blocks on *OPC? until all pending operations have finished, optionally
+        sending `command` ahead of it in the same transaction.
+        Returns False if the query times out or isn't understood.
+        """
+        previous_timeout = self.instrument.timeout
+        self.instrument.timeout = int(timeout_s * 1000)
+        try:
+            query = f"{command};*OPC?" if command else "*OPC?"
+            return int(float(self.query(query))) == 1
+        except visa.errors.VisaIOError:
+            # Drop the late *OPC? reply so it isn't read as the next query's answer
+            self.instrument.clear()
+            return False
+        except ValueError:
+            return False
+        finally:
+            self.instrument.timeout = previous_timeout
+
+    def wait_for_service_request(self, timeout_s):
+        """
+        Arms an operation-complete service request (*ESE 1;*SRE 32;*OPC) and
+        blocks until the instrument asserts SRQ. A serial poll right after
+        arming checks that status reporting works at all and catches
+        operations that are already complete. Returns False if SRQs aren't
+        available on this resource or the wait times out.
+        """
+        previous_timeout = self.instrument.timeout
+        self.instrument.timeout = int(timeout_s * 1000)
+        try:
+            self.write("*CLS;*ESE 1;*SRE 32;*OPC")
+            if self.instrument.read_stb() & 32:
+                return True
+            self.instrument.wait_for_srq(int(timeout_s * 1000))
+            return True
+        except (visa.errors.VisaIOError, AttributeError):
+            return False
+        finally:
+            self.instrument.timeout = previous_timeout
 
     def _wait_for_measurement(self, timeout=600):
         """Waits for a measurement to complete, returning the number of signals found."""
         print("Measurement in progress...")
         start_time = time.time()
         wait_interval = 2
+
+        # Briefly wait for an SRQ before polling. No *OPC? here: a timed-out
+        # *OPC? would need a device clear in the middle of the measurement.
+        if self.wait_for_service_request(SRQ_WAIT_S):
+            try:
+                num_signals = int(self.query("SIGLEN?"))
+                # MEASALLSIGS may still be running in the background, so an
+                # empty list isn't final; keep polling until signals appear
+                if num_signals > 0:
+                    print(f"Measurement complete. Found {num_signals} signals.")
+                    return num_signals
+            except (visa.errors.VisaIOError, ValueError):
+                print("Warning: Could not read number of signals. Falling back to polling...")
+
+        # Poll until signals appear; SRQ may fire before the list is filled
         while time.time() - start_time < timeout:
             try:
                 num_signals = int(self.query("SIGLEN?"))
@@ -118,7 +223,7 @@ class HP8593EM:
                     return num_signals
                 else:
                     print("Waiting for signals...")
-                    time.sleep(wait_interval * 5)
+                    time.sleep(wait_interval)
             except visa.errors.VisaIOError:
                 time.sleep(wait_interval)
             except ValueError:
@@ -128,21 +233,46 @@ class HP8593EM:
         print("Error: Timed out waiting for measurement to complete.")
         return 0
 
+    def _fetch_signal_batch(self, indices):
+        """Fetches several signals with one compound SIGPOS/SIGRESULT? query."""
+        response = self.query(";".join(f"SIGPOS {i};SIGRESULT?" for i in indices))
+        responses = _split_responses(response)
+        # Replies may arrive as one joined line or one line per query
+        while len(responses) < len(indices):
+            responses.extend(_split_responses(self.read()))
+        return dict(zip(indices, responses))
+
+    def _fetch_signal_single(self, index):
+        """Fetches one signal with separate SIGPOS and SIGRESULT? transactions."""
+        self.write(f"SIGPOS {index}")
+        return self.query("SIGRESULT?")
+
     def _fetch_signal_data(self, num_signals, timeout=600):
         """Fetches the data for each signal from the instrument."""
         signals = {}
         i = 1
         start_time = time.time()
         wait_interval = 2
+        use_compound = True
         
         while i <= num_signals and time.time() - start_time < timeout:
+            # Keep batches small enough to fit the instrument's input buffer
+            batch = list(range(i, min(i + SIGNAL_BATCH_SIZE, num_signals + 1)))
             try:
-                self.write(f"SIGPOS {i}")
-                print(f"Fetching signal {i} of {num_signals}...")
-                signals[i] = self.query("SIGRESULT?")
-                i += 1
+                print(f"Fetching signals {batch[0]}-{batch[-1]} of {num_signals}...")
+                if use_compound:
+                    try:
+                        signals.update(self._fetch_signal_batch(batch))
+                    except visa.errors.VisaIOError:
+                        print("Warning: Compound signal query failed. Fetching signals one at a time from now on...")
+                        use_compound = False
+                        self.instrument.clear()
+                if not use_compound:
+                    for index in batch:
+                        signals[index] = self._fetch_signal_single(index)
+                i = batch[-1] + 1
             except visa.errors.VisaIOError:
-                print(f"Warning: VISA error fetching signal {i}. Retrying...")
+                print(f"Warning: VISA error fetching signals {batch[0]}-{batch[-1]}. Retrying...")
                 time.sleep(wait_interval)
 
         if len(signals) < num_signals:
@@ -158,16 +288,26 @@ class HP8593EM:
         num_signals = self._wait_for_measurement()
         if num_signals == 0:
             print("No signals found.")
-            return []
+            return np.empty((0, 2))
         
         raw_signals = self._fetch_signal_data(num_signals)
         peaks = self._parse_peak_data(raw_signals)
         return peaks
 
     def _parse_peak_data(self, raw_signals):
-        """Parses raw signal strings into a list of (frequency, power) tuples."""
+        """Parses raw signal strings into an (N, 2) array of (frequency, power) rows."""
+        signal_strs = [raw_signals[i] for i in sorted(raw_signals)]
+        # Convert every signal's frequency and amplitude fields in one go
+        try:
+            fields = np.array([s.strip().split(',')[1:3] for s in signal_strs], dtype=np.float64)
+            # Raises ValueError unless every response had both fields
+            fields = fields.reshape(len(signal_strs), 2)
+            return fields * [1e6, 1.0]
+        except ValueError:
+            pass # At least one malformed response; parse them individually below
+
         peaks = []
-        for signal_str in raw_signals.values():
+        for signal_str in signal_strs:
             try:
                 parts = signal_str.strip().split(',')
                 freq_mhz = float(parts[1])
@@ -175,4 +315,4 @@ class HP8593EM:
                 peaks.append((freq_mhz * 1e6, amp_dbm))
             except (ValueError, IndexError):
                 print(f"Warning: Could not parse peak data point: '{signal_str}'")
-        return peaks
+        return np.array(peaks, dtype=np.float64).reshape(-1, 2)
@@ -1,54 +1,84 @@
+import logging
 from hp8593em import HP8593EM
 import pyvisa as visa
 import time
+import io
+import re
+import sys
+import numpy as np
 import analysis
 from visa_utils import discover_and_connect
 
 COMPENSATION_FILE = 'ext_att_compensation.csv'
 
+# Carrier frequencies the analyzer can measure, in Hz
+VALID_RANGE = (100e3, 11e9)
+
+# Number with an optional unit suffix; anything matching is safe to parse.
+# Only spaces are allowed as padding since parse_frequency only strips those.
+_FREQ_INPUT_RE = re.compile(r'^ *[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:e[+-]?\d+)? *(?:[gmk](?:hz)?|hz)? *$', re.IGNORECASE)
+
+def in_valid_range(freq_hz, valid_range=VALID_RANGE):
+    """Checks that a frequency lies within the given (low, high) range."""
+    return valid_range[0] <= freq_hz <= valid_range[1]
+
 def get_carrier_frequency():
     """Prompts user for carrier frequency and parses it."""
     while True:
-        try:
-            freq_str = input("Enter carrier frequency (e.g., 100kHz, 2.4GHz, 11GHz): ")
-            freq_hz = analysis.parse_frequency(freq_str)
-
-            if 100e3 <= freq_hz <= 11e9:
-                return freq_hz
-            else:
-                print("Frequency must be between 100kHz and 11GHz.")
-        except (ValueError, IndexError):
+        freq_str = input("Enter carrier frequency (e.g., 100kHz, 2.4GHz, 11GHz): ")
+        if not _FREQ_INPUT_RE.match(freq_str):
             print("Invalid input. Please enter a valid frequency (e.g., '100mhz', '2.4g').")
+            continue
+
+        freq_hz = analysis.parse_frequency(freq_str)
+        if in_valid_range(freq_hz):
+            return freq_hz
+        print("Frequency must be between 100kHz and 11GHz.")
 
-def print_peak_details(freq, power, comp_freqs, comp_dbs):
+_PEAK_LINE = "  Frequency: {}, Measured Power: {:.2f} dBm\n"
+_COMPENSATION_LINES = "  Compensation: {:.2f} dB\n  Corrected Power: {:.2f} dBm = {}\n"
+
+def print_peak_details(freq, power, compensation_db, corrected_power, corrected_power_watts, out=None):
     """Prints the details of a single signal peak, including compensation."""
-    compensation_db = analysis.get_compensation(freq, comp_freqs, comp_dbs)
-    corrected_power = power - compensation_db
-    print(f"  Frequency: {analysis.format_frequency(freq)}, Measured Power: {power:.2f} dBm")
+    out = out or sys.stdout
+    out.write(_PEAK_LINE.format(analysis.format_frequency(freq), power))
     if compensation_db != 0.0:
-        print(f"  Compensation: {compensation_db:.2f} dB")
-        print(f"  Corrected Power: {corrected_power:.2f} dBm = {analysis.dbm_to_watts_formatted(corrected_power)}")
+        out.write(_COMPENSATION_LINES.format(compensation_db, corrected_power, corrected_power_watts))
+
+def print_peak_group(peaks, comp, out=None):
+    """Prints details for a group of peaks, compensating them all at once."""
+    peaks = np.asarray(peaks, dtype=np.float64).reshape(-1, 2)
+    compensation_dbs = comp.apply(peaks[:, 0])
+    corrected_powers = peaks[:, 1] - compensation_dbs
+    corrected_watts = analysis.dbm_array_to_watts_formatted(corrected_powers)
+    for details in zip(peaks[:, 0].tolist(), peaks[:, 1].tolist(), compensation_dbs.tolist(),
+                       corrected_powers.tolist(), corrected_watts):
+        print_peak_details(*details, out=out)
 
-def print_peak_report(carrier_peaks, spurious_peaks, comp_freqs, comp_dbs):
+def print_peak_report(carrier_peaks, spurious_peaks, comp, out=None):
     """Prints a formatted report of carrier and spurious peaks."""
-    if carrier_peaks:
-        print("\n--- Carrier Signal Detected ---")
-        for freq, power in carrier_peaks:
-            print_peak_details(freq, power, comp_freqs, comp_dbs)
-
-    if spurious_peaks:
-        print("\n--- Spurious Emissions Detected ---")
-        for freq, power in spurious_peaks:
-            print_peak_details(freq, power, comp_freqs, comp_dbs)
+    # Build the whole report in memory and write it out in one call
+    buf = io.StringIO()
+    if len(carrier_peaks):
+        buf.write("\n--- Carrier Signal Detected ---\n")
+        print_peak_group(carrier_peaks, comp, out=buf)
+
+    if len(spurious_peaks):
+        buf.write("\n--- Spurious Emissions Detected ---\n")
+        print_peak_group(spurious_peaks, comp, out=buf)
     
-    if not spurious_peaks and carrier_peaks:
-        print("\nNo significant spurious emissions found.")
+    if not len(spurious_peaks) and len(carrier_peaks):
+        buf.write("\nNo significant spurious emissions found.\n")
+
+    out = out or sys.stdout
+    out.write(buf.getvalue())
+    out.flush()
 
 
 
 def main():
     """Main execution function."""
-    comp_freqs, comp_dbs = analysis.load_compensation_file(COMPENSATION_FILE)
+    comp = analysis.load_compensation(COMPENSATION_FILE)
     sa = None
 
     try:
@@ -66,19 +96,22 @@ def main():
 
         sa.set_center_frequency((stop_freq + 100e3) / 2)
         sa.set_span(stop_freq - 100e3)
+        # *OPC? returns as soon as SP is parsed, so give the analyzer time to
+        # settle on the new span before MEASALLSIGS
         time.sleep(2)
         
         peaks = sa.find_peaks_emc()
 
-        if not peaks:
+        if len(peaks) == 0:
             print("No emissions of any sort in the search range were found.")
             return
             
         carrier_peaks, spurious_peaks = analysis.separate_carrier_and_spurious(peaks, carrier_freq)
-        print_peak_report(carrier_peaks, spurious_peaks, comp_freqs, comp_dbs)
+        print_peak_report(carrier_peaks, spurious_peaks, comp)
         
         note = input("Enter a note for this measurement: ")
-        analysis.append_peaks_to_csv(carrier_peaks, spurious_peaks, comp_freqs, comp_dbs, note)
+        with analysis.CsvAppender() as report:
+            report.append(carrier_peaks, spurious_peaks, comp, note)
 
     except (visa.errors.VisaIOError, ConnectionError) as e:
         print(f"Error communicating with instrument: {e}")
@@ -90,4 +123,5 @@ def main():
         print("Connection closed.")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
\ No newline at end of file
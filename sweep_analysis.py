@@ -1,28 +1,28 @@
+import logging
 import pyvisa
 import numpy as np
 import matplotlib.pyplot as plt
 import csv
+import time
+from functools import lru_cache
 from hp8593em import HP8593EM
 from hp8673b import HP8673B
 from visa_utils import discover_and_connect
 
+# Time for the HP8673B to settle after a CW frequency change, in seconds
+SOURCE_SETTLE_S = 0.1
+
+# (suffix, multiplier) pairs, longest suffixes first so 'ghz' wins over 'hz'
+_FREQ_SUFFIXES = (('ghz', 1e9), ('mhz', 1e6), ('khz', 1e3), ('hz', 1.0))
+
+@lru_cache(maxsize=128)
 def parse_frequency(freq_str: str) -> float:
     """Parses a frequency string with units (e.g., '100mhz', '2.4ghz') into Hz."""
     freq_str = freq_str.lower().strip()
-    multiplier = 1
-    if freq_str.endswith('ghz'):
-        multiplier = 1e9
-        freq_str = freq_str[:-3]
-    elif freq_str.endswith('mhz'):
-        multiplier = 1e6
-        freq_str = freq_str[:-3]
-    elif freq_str.endswith('khz'):
-        multiplier = 1e3
-        freq_str = freq_str[:-3]
-    elif freq_str.endswith('hz'):
-        freq_str = freq_str[:-2]
-    
-    return float(freq_str) * multiplier
+    for suffix, multiplier in _FREQ_SUFFIXES:
+        if freq_str.endswith(suffix):
+            return float(freq_str[:-len(suffix)]) * multiplier
+    return float(freq_str)
 
 def halton(index, base):
     """Generator for Halton sequence."""
@@ -35,18 +35,31 @@ def halton(index, base):
         i = int(i / base)
     return result
 
+def halton_base2(n):
+    """Returns the first n points (indices 1..n) of the base-2 Halton sequence."""
+    i = np.arange(1, n + 1, dtype=np.uint64)
+    result = np.zeros(n)
+    # Base 2 is the bit-reversed index: bit b contributes 1 / 2^(b+1)
+    for b in range(int(n).bit_length()):
+        result += ((i >> np.uint64(b)) & np.uint64(1)) * (1.0 / (1 << (b + 1)))
+    return result
+
 def main():
     """
     Main function to run the sweep analysis.
     """
     sa = None
     sg = None
-    results = []
+    # (frequency, power) rows, filled in as the sweep progresses
+    results = np.empty((0, 2))
+    num_measured = 0
+    csv_file = None
     
     # Setup plot
     plt.ion()
     fig, ax = plt.subplots()
-    line, = ax.plot([], [], 'o-')
+    # Drawn by hand with blitting during the sweep, so keep it out of full redraws
+    line, = ax.plot([], [], 'o-', animated=True)
     ax.set_xlabel("Frequency (MHz)")
     ax.set_ylabel("Power (dBm)")
     ax.grid()
@@ -64,6 +77,7 @@ def main():
         start_freq_str = input("Enter start frequency (e.g., 100MHz, 1.5GHz): ")
         end_freq_str = input("Enter end frequency (e.g., 500MHz, 2.5GHz): ")
         points_str = input("Enter number of points (optional, default is 1000 for Halton): ")
+        csv_filename = input("Enter CSV filename to save data (or press Enter to skip): ")
 
         start_freq = parse_frequency(start_freq_str)
         end_freq = parse_frequency(end_freq_str)
@@ -78,9 +92,8 @@ def main():
         else:
             num_points = 1000  # Default for Halton
             print(f"Performing Halton sequence sweep with {num_points} points.")
-            frequencies = [start_freq + (end_freq - start_freq) * halton(i, 2) for i in range(1, num_points + 1)]
-            frequencies.insert(0, start_freq)
-            frequencies.append(end_freq)
+            frequencies = start_freq + (end_freq - start_freq) * halton_base2(num_points)
+            frequencies = np.concatenate(([start_freq], frequencies, [end_freq]))
 
 
         # Setup devices
@@ -88,37 +101,81 @@ def main():
         sg.enable_rf(True)
         sa.set_zero_span()
 
+        results = np.empty((len(frequencies), 2))
+
+        # Stream each point to disk as it's measured so an aborted sweep keeps its data
+        csv_writer = None
+        if csv_filename:
+            if not csv_filename.lower().endswith('.csv'):
+                csv_filename += '.csv'
+            csv_file = open(csv_filename, 'w', newline='', buffering=1)
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(['Frequency (Hz)', 'Power (dBm)'])
+
+        # Cache the static parts of the plot so each point only redraws the line.
+        # Re-cache after every full redraw (resizes included) so a stale
+        # background is never blitted over the new canvas.
+        background = None
+
+        def on_draw(event):
+            nonlocal background
+            background = fig.canvas.copy_from_bbox(ax.bbox)
+            ax.draw_artist(line)
+
+        fig.canvas.mpl_connect('draw_event', on_draw)
+        fig.canvas.draw()
+
         # Sweep
-        measured_freqs = []
-        measured_powers = []
+        min_power, max_power = float('inf'), float('-inf')
+        use_compound = True
         for freq in frequencies:
             print(f"Measuring at {freq/1e6:.3f} MHz...")
             sg.set_frequency(freq)
-            sa.set_center_frequency(freq)
-            
-            import time
-            time.sleep(0.1)
-
-            power = sa.get_marker_power()
-            results.append((freq, power))
+            # Let the source settle on the new CW frequency before measuring it
+            time.sleep(SOURCE_SETTLE_S)
+            power = None
+            if use_compound:
+                try:
+                    power = sa.measure_marker_power(freq)
+                except (pyvisa.errors.VisaIOError, ValueError):
+                    print("  Compound measurement failed. Using separate commands from now on.")
+                    use_compound = False
+                    sa.instrument.clear()
+            if power is None:
+                sa.set_center_frequency(freq)
+                time.sleep(0.1)
+                power = sa.get_marker_power()
+
+            results[num_measured] = (freq, power)
+            num_measured += 1
+            if csv_writer:
+                csv_writer.writerow((float(freq), power))
             print(f"  Power: {power:.2f} dBm")
 
             # Update plot
-            measured_freqs.append(freq / 1e6)
-            measured_powers.append(power)
-            line.set_data(measured_freqs, measured_powers)
+            line.set_data(results[:num_measured, 0] * 1e-6, results[:num_measured, 1])
             
-            # Adjust Y axis limits
-            if measured_powers:
-                ax.set_ylim(min(measured_powers) - 5, max(measured_powers) + 5)
-                
-            plt.pause(0.01)
+            # Adjust Y axis limits only when the power range grows; the full
+            # redraw re-caches the background through on_draw
+            if power < min_power or power > max_power:
+                min_power = min(min_power, power)
+                max_power = max(max_power, power)
+                ax.set_ylim(min_power - 5, max_power + 5)
+                fig.canvas.draw()
+
+            fig.canvas.restore_region(background)
+            ax.draw_artist(line)
+            fig.canvas.blit(ax.bbox)
+            fig.canvas.flush_events()
 
     except ConnectionError as e:
         print(f"Error: {e}")
     except ValueError:
         print("Invalid frequency or number of points.")
     finally:
+        if csv_file:
+            csv_file.close()
+            print(f"Data saved to {csv_filename}")
         if sa:
             sa.close()
         if sg:
@@ -126,34 +183,25 @@ def main():
             sg.close()
         print("Connections closed.")
         
-        if results:
+        if num_measured:
             print("\n--- Final Results ---")
             # Sort results by frequency for clean plotting and reporting
-            results.sort(key=lambda x: x[0])
-            for freq, power in results:
+            results = results[:num_measured]
+            results = results[results[:, 0].argsort()]
+            for freq, power in results.tolist():
                 print(f"{freq/1e6:.3f} MHz: {power:.2f} dBm")
 
             # Update final plot with sorted data
-            sorted_freqs_mhz = [r[0] / 1e6 for r in results]
-            sorted_powers = [r[1] for r in results]
+            sorted_freqs_mhz = results[:, 0] * 1e-6
+            sorted_powers = results[:, 1]
+            line.set_animated(False)
             line.set_data(sorted_freqs_mhz, sorted_powers)
-            ax.set_xlim(min(sorted_freqs_mhz), max(sorted_freqs_mhz))
-            ax.set_ylim(min(sorted_powers) - 5, max(sorted_powers) + 5)
+            ax.set_xlim(sorted_freqs_mhz[0], sorted_freqs_mhz[-1])
+            ax.set_ylim(sorted_powers.min() - 5, sorted_powers.max() + 5)
             fig.canvas.draw()
             fig.canvas.flush_events()
 
 
-            # Save CSV
-            csv_filename = input("Enter CSV filename to save data (or press Enter to skip): ")
-            if csv_filename:
-                if not csv_filename.lower().endswith('.csv'):
-                    csv_filename += '.csv'
-                with open(csv_filename, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['Frequency (Hz)', 'Power (dBm)'])
-                    writer.writerows(results)
-                print(f"Data saved to {csv_filename}")
-
             # Save Plot
             png_filename = input("Enter PNG filename to save plot (or press Enter to skip): ")
             if png_filename:
@@ -167,4 +215,5 @@ def main():
         plt.show()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
@@ -1,13 +1,114 @@
 import pyvisa
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def discover_and_connect(device_class_map):
+# ID? is answered quickly by any responsive instrument, so don't wait long
+# on addresses where nothing (or something powered off) is listening
+PROBE_TIMEOUT_MS = 2000
+
+# Where per-machine device address hints are read from (JSON object)
+ADDRESS_HINTS_ENV = 'GPIB_ADDRESS_HINTS'
+ADDRESS_HINTS_FILE = os.path.expanduser('~/.gpibrc')
+
+_RM = None
+
+def get_rm():
+    """
+    Returns the process-wide pyvisa ResourceManager, creating it on first use.
+    Opening one loads the VISA backend and can take a while, so it is shared.
+    Don't close it while the process is still using instruments.
+    """
+    global _RM
+    if _RM is None:
+        _RM = pyvisa.ResourceManager()
+    return _RM
+
+def configure_resource(resource):
+    """
+    Applies bulk-transfer I/O settings to a freshly opened resource: large
+    read chunks, '\n' read/write terminators and EOI on writes. Without an
+    explicit read terminator some backends poll for EOI a byte at a time.
+    Instruments that use a different end-of-string character must override
+    these after calling this.
+    """
+    resource.chunk_size = 65536
+    resource.read_termination = '\n'
+    resource.write_termination = '\n'
+    resource.send_end = True
+
+def _probe(rm, resource_str):
+    """
+    Opens a resource and queries its identity.
+
+    Returns:
+        A (resource_str, identity, resource) tuple. identity is None if the
+        resource opened but couldn't be queried.
+    """
+    resource = rm.open_resource(resource_str)
+    configure_resource(resource)
+    default_timeout = resource.timeout
+    resource.timeout = PROBE_TIMEOUT_MS
+    try:
+        identity = resource.query("ID?").strip()
+    except pyvisa.errors.VisaIOError:
+        identity = None
+    finally:
+        resource.timeout = default_timeout
+    return resource_str, identity, resource
+
+def _device_resource(device):
+    """Returns the VISA resource wrapped by a device object."""
+    return getattr(device, 'resource', None) or getattr(device, 'instrument', None)
+
+def load_address_hints():
+    """
+    Loads known device addresses, e.g. {"8593EM": "GPIB0::18::INSTR"}, from
+    the GPIB_ADDRESS_HINTS environment variable or, failing that, the
+    ~/.gpibrc file. Both hold a JSON object. Returns {} if neither is set.
+    """
+    hints = {}
+    try:
+        hints_json = os.environ.get(ADDRESS_HINTS_ENV)
+        if hints_json:
+            hints = json.loads(hints_json)
+        elif os.path.exists(ADDRESS_HINTS_FILE):
+            with open(ADDRESS_HINTS_FILE) as f:
+                hints = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not load GPIB address hints: {e}")
+        return {}
+    if not isinstance(hints, dict):
+        print("Warning: GPIB address hints must be a JSON object. Ignoring them.")
+        return {}
+    for device_id, resource_str in list(hints.items()):
+        if not isinstance(resource_str, str):
+            print(f"Warning: Ignoring GPIB address hint for {device_id}: {resource_str!r} is not a resource string.")
+            del hints[device_id]
+    return hints
+
+def _match_device(identity, device_class_map, found_devices):
+    """Returns the ID of a not-yet-found device whose ID string appears in identity."""
+    for device_id in device_class_map:
+        if device_id in identity and device_id not in found_devices:
+            return device_id
+    return None
+
+def discover_and_connect(device_class_map, address_hints=None):
     """
     Discovers, connects to, and initializes specified GPIB devices.
 
+    Hinted addresses are tried first. Any devices still missing are then
+    searched for by probing all GPIB addresses concurrently, stopping as
+    soon as every requested device has been found.
+
     Args:
         device_class_map: A dictionary where keys are device ID strings
                           (e.g., '8593EM') and values are the corresponding
                           wrapper classes (e.g., HP8593EM).
+        address_hints: Optional dictionary mapping device ID strings to the
+                       resource string they are expected at. Defaults to
+                       load_address_hints().
 
     Returns:
         A dictionary of initialized device objects, keyed by their device ID string.
@@ -15,9 +116,9 @@ def discover_and_connect(device_class_map):
     Raises:
         ConnectionError: If not all specified devices are found.
     """
-    rm = pyvisa.ResourceManager()
-    resources = [r for r in rm.list_resources() if r.startswith("GPIB")]
-    print(f"Searching for {list(device_class_map.keys())} in GPIB resources: {resources}")
+    if address_hints is None:
+        address_hints = load_address_hints()
+    rm = get_rm()
 
     found_devices = {}
     opened_resources = []
@@ -25,23 +126,61 @@ def discover_and_connect(device_class_map):
     device_ids_to_find = list(device_class_map.keys())
 
     try:
-        for resource_str in resources:
-            if len(found_devices) == len(device_ids_to_find):
-                break
-
+        # Try the expected addresses first; a correct hint needs no bus scan
+        for device_id, resource_str in address_hints.items():
+            if device_id not in device_class_map or device_id in found_devices:
+                continue
             try:
-                resource = rm.open_resource(resource_str)
+                resource_str, identity, resource = _probe(rm, resource_str)
+            except (pyvisa.errors.VisaIOError, ValueError, TypeError) as e:
+                # Unreachable or malformed address; fall back to the scan
+                print(f"Warning: Could not open hinted address {resource_str!r} for {device_id}: {e}")
+                continue
+            if identity is not None and _match_device(identity, device_class_map, found_devices) == device_id:
+                print(f"Found {device_id} at hinted address {resource_str}")
                 opened_resources.append(resource)
-                identity = resource.query("ID?").strip()
+                found_devices[device_id] = device_class_map[device_id](resource)
+            else:
+                print(f"Warning: {device_id} not found at hinted address {resource_str}.")
+                resource.close()
+
+        if len(found_devices) < len(device_ids_to_find):
+            claimed = {_device_resource(dev).resource_name for dev in found_devices.values()}
+            resources = [r for r in rm.list_resources() if r.startswith("GPIB") and r not in claimed]
+            missing = [d for d in device_ids_to_find if d not in found_devices]
+            print(f"Searching for {missing} in GPIB resources: {resources}")
+
+            with ThreadPoolExecutor(max_workers=max(1, len(resources))) as executor:
+                futures = [executor.submit(_probe, rm, resource_str) for resource_str in resources]
+                handled = set()
+                for future in as_completed(futures):
+                    handled.add(future)
+                    try:
+                        resource_str, identity, resource = future.result()
+                    except pyvisa.errors.VisaIOError:
+                        continue # Ignore devices that can't be opened
+                    opened_resources.append(resource)
+                    if identity is None:
+                        continue # Ignore devices that can't be queried
 
-                for device_id, device_class in device_class_map.items():
-                    if device_id in identity and device_id not in found_devices:
+                    device_id = _match_device(identity, device_class_map, found_devices)
+                    if device_id is not None:
                         print(f"Found {device_id} at {resource_str}")
                         # Initialize the class with the resource
-                        found_devices[device_id] = device_class(resource)
-                        break 
-            except pyvisa.errors.VisaIOError:
-                continue # Ignore devices that can't be queried
+                        found_devices[device_id] = device_class_map[device_id](resource)
+
+                    if len(found_devices) == len(device_ids_to_find):
+                        for pending in futures:
+                            pending.cancel()
+                        break
+
+            # Collect resources from probes that were already running when we stopped
+            for future in futures:
+                if future not in handled and not future.cancelled():
+                    try:
+                        opened_resources.append(future.result()[2])
+                    except pyvisa.errors.VisaIOError:
+                        pass
 
         # Verify all devices were found
         for device_id in device_ids_to_find:
@@ -49,7 +188,7 @@ def discover_and_connect(device_class_map):
                 raise ConnectionError(f"Could not find device '{device_id}'.")
 
         # Close unused resources that were successfully opened
-        all_instantiated_resources = [dev.resource for dev in found_devices.values()]
+        all_instantiated_resources = [_device_resource(dev) for dev in found_devices.values()]
         for res in opened_resources:
             if res not in all_instantiated_resources:
                 res.close()
@@ -63,5 +202,5 @@ def discover_and_connect(device_class_map):
                 # This might fail if the resource is already gone, but it's worth trying
                 res.close()
             except pyvisa.errors.VisaIOError:
-                pass 
+                pass
         raise